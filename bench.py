@@ -0,0 +1,330 @@
+"""Замеры производительности без окна: python bench.py [имя_замера ...]
+
+    sync     - пропускная способность и задержка синхронизации сцены через
+               локальный сокет (ведущий и ведомый в одном процессе)
+    startup  - холодный старт процесса до готовой формы main.ui в пустом
+               QMainWindow (offscreen): исходный main.py (BASELINE_REV),
+               кэшированная форма и uic.loadUi
+    query    - индекс SceneQuery: попадание, k ближайших, подсчёт по области,
+               карта плотности в сравнении с полным перебором
+    journal  - журнал автосохранения: поток записей при перетаскивании
+               и воспроизведение 1M операций
+    paste    - копирование, вставка и дублирование 50k выделенных фигур
+               с подписчиками окна (SceneQuery и журнал)
+    group    - перенос и попадание: 500 отдельных фигур против одной группы
+"""
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+BASELINE_REV = "d238fa9"  # main.py до оптимизаций - точка отсчёта для startup
+
+from PyQt6.QtCore import QCoreApplication, QRect
+
+
+def _quiet():
+    # FigureStorage печатает каждое действие - в замерах это только мешает
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def _wait(app, predicate, timeout=30.0):
+    deadline = time.perf_counter() + timeout
+    while not predicate():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("benchmark condition not reached")
+        app.processEvents()
+
+
+def _make_scene(storage, n, width=800, height=600):
+    from main import FIGURE_TYPES, Rectangle
+    from scene_codec import OP_ADD
+    kind = FIGURE_TYPES.index(Rectangle)
+    records = []
+    for i in range(n):
+        x, y = i % width, (i // width) % height
+        records.append((OP_ADD, i + 1, kind, True, 0xff010101, 0x64ffffff, 2, 0,
+                        [[x, y], [x + 10, y + 10], [x + 10, y], [x, y + 10]]))
+    storage.apply_records(records)
+
+
+def bench_sync(app, n=20000, rounds=200, drag_steps=100):
+    from main import FigureStorage
+    from scene_sync import SceneSyncServer, SceneSyncClient
+
+    name = f"paint-bench-{os.getpid()}"
+    host, follower = FigureStorage(), FigureStorage()
+    _make_scene(host, n)
+    server = SceneSyncServer(host, name)
+
+    t0 = time.perf_counter()
+    client = SceneSyncClient(follower, name)
+    _wait(app, lambda: len(follower.get_all()) == n)
+    dt = time.perf_counter() - t0
+    print(f"sync snapshot: {n} figures in {dt * 1000:.1f} ms ({n / dt:,.0f} figures/s)")
+
+    # задержка: одиночный сдвиг одной фигуры до применения у ведомого
+    probe = host.get_all()[0]
+    with _quiet():
+        probe.selected = True
+    bounds = QRect(-10**6, -10**6, 2 * 10**6, 2 * 10**6)
+    samples = []
+    for i in range(rounds):
+        t0 = time.perf_counter()
+        host.move_selected(1 if i % 2 == 0 else -1, 0, bounds)
+        target = probe.points[0][0]
+        _wait(app, lambda: follower.find(probe.fid).points[0][0] == target)
+        samples.append(time.perf_counter() - t0)
+    samples.sort()
+    print(f"sync latency: p50 {samples[len(samples) // 2] * 1000:.2f} ms, "
+          f"p99 {samples[int(len(samples) * 0.99)] * 1000:.2f} ms "
+          f"(batch interval {SceneSyncServer.FLUSH_INTERVAL_MS} ms)")
+
+    # пропускная способность: перетаскивание всей сцены
+    with _quiet():
+        for fig in host.get_all():
+            fig.selected = True
+    t0 = time.perf_counter()
+    for _ in range(drag_steps):
+        host.move_selected(1, 1, bounds)
+        app.processEvents()
+    last = host.get_all()[-1]
+    target = [list(p) for p in last.points]
+    _wait(app, lambda: follower.find(last.fid).points == target)
+    dt = time.perf_counter() - t0
+    print(f"sync drag: {n * drag_steps:,} move deltas in {dt:.2f} s "
+          f"({n * drag_steps / dt:,.0f} deltas/s before coalescing)")
+
+    server.close()
+    client.deleteLater()
+
+
+def bench_startup(app, runs=10):
+    # main.ui в репозитории - не форма окна Main (в ней нет canvas, pen_width и т.д.),
+    # поэтому Main целиком не стартует; замеряем импорт main и загрузку формы в пустое окно.
+    # Исходный main.py из BASELINE_REV запускается так же, как он грузил форму: uic из cwd.
+    base = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, QT_QPA_PLATFORM="offscreen")
+    child = (
+        "import sys, time; t0 = time.perf_counter()\n"
+        "from PyQt6.QtWidgets import QApplication, QMainWindow\n"
+        "import main\n"
+        "app = QApplication(sys.argv); win = QMainWindow(); t1 = time.perf_counter()\n"
+        "if sys.argv[1] == 'compiled':\n"
+        "    main.load_ui_class()().setupUi(win)\n"
+        "else:\n"
+        "    from PyQt6 import uic; uic.loadUi(getattr(main, 'UI_PATH', 'main.ui'), win)\n"
+        "t2 = time.perf_counter(); print(t2 - t0, t2 - t1)\n"
+    )
+
+    def launch(mode, cwd=base):
+        t0 = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", child, mode], cwd=cwd, env=env,
+                             capture_output=True, text=True, check=True).stdout
+        total, load = map(float, out.split()[-2:])
+        return time.perf_counter() - t0, total, load
+
+    modes = []
+    try:
+        old = subprocess.run(["git", "show", f"{BASELINE_REV}:main.py"], cwd=base,
+                             capture_output=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        print(f"startup baseline: {BASELINE_REV}:main.py unavailable, skipped")
+    else:
+        old_dir = tempfile.mkdtemp()
+        with open(os.path.join(old_dir, "main.py"), "wb") as f:
+            f.write(old)
+        with open(os.path.join(base, "main.ui"), "rb") as src, \
+                open(os.path.join(old_dir, "main.ui"), "wb") as dst:
+            dst.write(src.read())
+        modes.append((f"baseline {BASELINE_REV}", "runtime", old_dir))
+        launch("runtime", old_dir)
+    modes += [("compiled ui", "compiled", base), ("uic.loadUi", "runtime", base)]
+
+    launch("compiled")  # прогрев: кэш формы и файловый кэш ОС
+    for label, mode, cwd in modes:
+        samples = sorted(launch(mode, cwd) for _ in range(runs))
+        wall, inproc, load = samples[runs // 2]
+        print(f"startup {label}: median {wall * 1000:.0f} ms process, "
+              f"{inproc * 1000:.0f} ms in-process, form load {load * 1000:.1f} ms ({runs} runs)")
+
+
+def bench_query(app, n=100000, queries=10000):
+    import random
+    from main import FigureStorage
+    from scene_query import SceneQuery
+
+    storage = FigureStorage()
+    _make_scene(storage, n, 4000, 4000)
+    t0 = time.perf_counter()
+    query = SceneQuery(storage)
+    print(f"query index build: {n} figures in {(time.perf_counter() - t0) * 1000:.0f} ms")
+
+    rnd = random.Random(1)
+    points = [(rnd.randrange(4000), rnd.randrange(4000)) for _ in range(queries)]
+    t0 = time.perf_counter()
+    for x, y in points:
+        query.hit(x, y)
+    dt_index = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for x, y in points[:100]:
+        any(f.hit_test(x, y) for f in storage.get_all())
+    dt_scan = (time.perf_counter() - t0) * queries / 100
+    print(f"query hit: {dt_index / queries * 1e6:.1f} us/query indexed, "
+          f"{dt_scan / queries * 1e6:.0f} us/query full scan")
+
+    t0 = time.perf_counter()
+    for x, y in points[:1000]:
+        query.nearest(x, y, 10)
+    dt_index = (time.perf_counter() - t0) / 1000
+    boxes = [(b.left(), b.top(), b.right(), b.bottom()) for b in (f.bounds() for f in storage.get_all())]
+    t0 = time.perf_counter()
+    for x, y in points[:10]:
+        sorted(SceneQuery._distance2(b, x, y) for b in boxes)[:10]
+    dt_scan = (time.perf_counter() - t0) / 10
+    print(f"query nearest k=10: {dt_index * 1e6:.0f} us/query indexed, "
+          f"{dt_scan * 1e6:.0f} us/query brute force")
+
+    t0 = time.perf_counter()
+    query.in_region(-10**6, -10**6, 10**6, 10**6)
+    print(f"query in_region (whole plane): {(time.perf_counter() - t0) * 1000:.0f} ms")
+
+    t0 = time.perf_counter()
+    for x, y in points[:100]:
+        query.count_by_type(x, y, x + 500, y + 500)
+    print(f"query count_by_type: {(time.perf_counter() - t0) * 10:.2f} ms/query")
+
+    t0 = time.perf_counter()
+    query.density(4000, 4000, 50)
+    print(f"query density 80x80: {(time.perf_counter() - t0) * 1000:.1f} ms")
+
+
+def bench_journal(app, n=5000, drag_steps=200, replay_ops=1000000):
+    from main import FigureStorage
+    from scene_journal import SceneJournal
+    from scene_codec import OP_MOVE
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.journal")
+    storage = FigureStorage()
+    _make_scene(storage, n)
+    journal = SceneJournal(storage, path)
+    journal.start()
+
+    # перетаскивание: каждый шаг - move-записи всех n выделенных фигур
+    with _quiet():
+        for fig in storage.get_all():
+            fig.selected = True
+    bounds = QRect(-10**6, -10**6, 2 * 10**6, 2 * 10**6)
+    worst = 0.0
+    t0 = time.perf_counter()
+    for i in range(drag_steps):
+        t = time.perf_counter()
+        storage.move_selected(1 if i % 2 == 0 else -1, 1, bounds)
+        worst = max(worst, time.perf_counter() - t)
+    dt = time.perf_counter() - t0
+    journal.close()
+    print(f"journal drag: {n * drag_steps:,} records in {dt:.2f} s ({n * drag_steps / dt:,.0f} records/s), "
+          f"worst step {worst * 1000:.1f} ms incl. move, file {os.path.getsize(path) / 1e6:.1f} MB")
+
+    # воспроизведение: снимок сцены и replay_ops записей сдвигов
+    figs = storage.get_all()
+    journal = SceneJournal(storage, path)
+    journal.CHECKPOINT_RECORDS = replay_ops * 2  # не сжимать во время наполнения
+    journal.start()
+    batch = 1000
+    for start in range(0, replay_ops, batch):
+        journal._on_figures_changed(OP_MOVE, figs[start % n:start % n + batch] or figs[:batch])
+    journal.close()
+    t0 = time.perf_counter()
+    restored = FigureStorage()
+    journal = SceneJournal(restored, path)
+    journal.start()
+    dt = time.perf_counter() - t0
+    journal.close()
+    print(f"journal replay: ~{replay_ops:,} ops in {dt:.2f} s ({replay_ops / dt:,.0f} ops/s), "
+          f"{len(restored.get_all())} figures restored")
+
+
+def bench_paste(app, n=50000):
+    from main import FigureStorage
+    from scene_query import SceneQuery
+    from scene_journal import SceneJournal
+
+    storage = FigureStorage()
+    _make_scene(storage, n)
+    # как в окне Main: индекс сцены и журнал получают каждую вставку
+    query = SceneQuery(storage)
+    journal = SceneJournal(storage, os.path.join(tempfile.mkdtemp(), "bench.journal"))
+    journal.start()
+    time.sleep(1)  # начальный снимок пишется фоновым потоком - в окне он давно готов к первой вставке
+    repaints = []
+    storage.canvas_updated.connect(lambda: repaints.append(1))
+    with _quiet():
+        for fig in storage.get_all():
+            fig.selected = True
+
+    t0 = time.perf_counter()
+    data = storage.copy_selected()
+    print(f"paste copy: {n} figures -> {len(data) / 1e6:.1f} MB in {(time.perf_counter() - t0) * 1000:.0f} ms")
+
+    del repaints[:]
+    with _quiet():
+        t0 = time.perf_counter()
+        storage.paste(data)
+        dt = time.perf_counter() - t0
+    print(f"paste: {n} figures in {dt * 1000:.0f} ms, {len(repaints)} repaint request(s)")
+
+    with _quiet():
+        t0 = time.perf_counter()
+        storage.duplicate_selected()
+        dt = time.perf_counter() - t0
+    print(f"paste duplicate: {n} figures in {dt * 1000:.0f} ms, scene now {len(storage.get_all())}")
+    journal.close()
+
+
+def bench_group(app, n=500, steps=200, hits=2000):
+    import random
+    from main import FigureStorage
+
+    bounds = QRect(-10**6, -10**6, 2 * 10**6, 2 * 10**6)
+    rnd = random.Random(1)
+    points = [(rnd.randrange(-200, 1000), rnd.randrange(-200, 800)) for _ in range(hits)]
+    for label, grouped in (("flat", False), ("group", True)):
+        storage = FigureStorage()
+        _make_scene(storage, n)
+        with _quiet():
+            for fig in storage.get_all():
+                fig.selected = True
+            if grouped:
+                storage.group_selected()
+        t0 = time.perf_counter()
+        for i in range(steps):
+            storage.move_selected(1 if i % 2 == 0 else -1, 0, bounds)
+        dt_move = (time.perf_counter() - t0) / steps
+        t0 = time.perf_counter()
+        for x, y in points:
+            any(f.hit_test(x, y) for f in storage.get_all())
+        dt_hit = (time.perf_counter() - t0) / hits
+        print(f"group {label}: move {dt_move * 1000:.2f} ms/step, hit-test {dt_hit * 1e6:.1f} us/point "
+              f"({n} primitives)")
+
+
+BENCHMARKS = {
+    "sync": bench_sync,
+    "startup": bench_startup,
+    "query": bench_query,
+    "journal": bench_journal,
+    "paste": bench_paste,
+    "group": bench_group,
+}
+
+
+if __name__ == "__main__":
+    app = QCoreApplication(sys.argv)
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name](app)
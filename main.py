@@ -1,12 +1,21 @@
 from dataclasses import dataclass, field
 import sys
 import os
-import json
-from PyQt6 import uic
-from PyQt6.QtCore import *
-from PyQt6.QtGui import *
-from PyQt6.QtWidgets import *
-import copy
+import gc
+import hashlib
+from contextlib import contextmanager
+import importlib.util
+from PyQt6.QtCore import QObject, QSize, QRect, QRectF, QPoint, QEvent, QTimer, QMimeData, Qt, pyqtSignal
+from PyQt6.QtGui import QColor, QPainter, QPen, QBrush, QPolygon
+from PyQt6.QtWidgets import QApplication, QMainWindow, QMessageBox, QColorDialog
+import scene_codec
+from scene_codec import OP_ADD, OP_DELETE, OP_MOVE, OP_RESTYLE, OP_CLEAR, OP_GROUP
+from scene_query import SceneQuery
+
+# подсветка выделения; общие на все фигуры - QColor здесь не меняют на месте.
+# Сравниваются по is: красный, выбранный пользователем, подсветкой не считается
+SELECTION_PEN_COLOR = QColor(255, 0, 0)
+SELECTION_BRUSH_COLOR = QColor(255, 0, 0, 100)
 
 @dataclass
 class DrawEssentials:
@@ -98,12 +107,52 @@ class DrawSettings(QObject):   # composition с DrawEssentials
         self.toolChanged.emit(self.__tool)
         self.radiusChanged.emit(self._ess.radius)
 
+_FIGURE_ATTRS = {}  # (тип фигуры, имя атрибута) -> есть ли он
+
+def _has(fig, name: str) -> bool:
+    """hasattr с кэшем по типу фигуры. Набор атрибутов задаёт класс фигуры, а промах
+    у QObject уходит в медленный поиск sip (~2 мкс против 0.1 на попадание)."""
+    key = (type(fig), name)
+    has = _FIGURE_ATTRS.get(key)
+    if has is None:
+        has = _FIGURE_ATTRS[key] = hasattr(fig, name)
+    return has
+
+_RECORD_FIELDS = {}  # тип фигуры -> (есть ли finished, есть ли radius)
+
+def _finished_radius(fig):
+    """(finished, radius) фигуры для записи; у кого их нет - True и 0. Один поиск по типу
+    вместо двух _has: to_record зовётся на каждую фигуру каждой дельты."""
+    has = _RECORD_FIELDS.get(type(fig))
+    if has is None:
+        has = _RECORD_FIELDS[type(fig)] = (_has(fig, "finished"), _has(fig, "radius"))
+    return (fig.finished if has[0] else True), (fig.radius if has[1] else 0)
+
+@contextmanager
+def _gc_paused():
+    """Без циклического сборщика на время пакетной операции: каждая новая фигура - это
+    несколько списков, и сборщик раз за разом обходил бы всю большую сцену."""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
 class FigureStorage(QObject):
     canvas_updated = pyqtSignal()
+    figures_changed = pyqtSignal(int, list)   # (op из scene_codec, фигуры) - для синхронизации
+    CLIPBOARD_MIME = "application/x-paint-figures"
+    PASTE_OFFSET = 10
 
     def __init__(self, settings: DrawSettings | None = None):
         super().__init__()
         self.__figures = []
+        self.__by_id = {}
+        self.__next_id = 1
+        self.__colors = {}        # rgba -> QColor, общие для фигур из дельт и буфера обмена
+        self.__last_paste = (None, 0)
         # use provided settings or create default one
         self.settings = settings if isinstance(settings, DrawSettings) else DrawSettings()
         # connect settings signals to update existing/selected figures
@@ -114,50 +163,86 @@ class FigureStorage(QObject):
 
     # --- signal handlers: propagate setting changes to selected figures ---
     def _on_pen_width_changed(self, w: int):
-        for f in self.get_selected():
+        selected = self.get_selected()
+        for f in self._leaves(selected):
             f.ess.pen_width = w
+        self._restyled(selected)
         self.canvas_updated.emit()
 
     def _on_brush_color_changed(self, c: QColor):
-        for f in self.get_selected():
+        selected = self.get_selected()
+        for f in self._leaves(selected):
             f.ess.brush_color = c
+        self._restyled(selected)
         self.canvas_updated.emit()
 
     def _on_pen_color_changed(self, c: QColor):
-        for f in self.get_selected():
+        selected = self.get_selected()
+        for f in self._leaves(selected):
             f.ess.pen_color = c
+        self._restyled(selected)
         self.canvas_updated.emit()
 
+    @staticmethod
+    def _leaves(figures):
+        # стиль задаётся простым фигурам, группы передают его своим детям
+        return [leaf for f in figures for leaf in f.leaves()]
+
+    def _restyled(self, figures):
+        for f in figures:
+            f.invalidate_bounds()  # толщина пера входит в границы
+        if figures:
+            self.figures_changed.emit(OP_RESTYLE, list(figures))
+
     def _on_radius_changed(self, r: int):
-        for f in self.get_selected():
+        selected = self.get_selected()
+        for f in self._leaves(selected):
             # if figures use radius concept, update attribute if present
             if hasattr(f, 'radius'):
                 try:
                     f.radius = r
                 except Exception:
                     pass
+        self._restyled(selected)  # радиус передаётся в записи OP_RESTYLE
         self.canvas_updated.emit()
 
     def adjust_size_selected(self, delta: int):
         """Попытаться изменить размер выбранных фигур (увеличить/уменьшить).
         Для примера изменяем pen_width или radius для фигур, где это применимо.
         """
-        changed = False
-        for f in self.get_selected():
-            if hasattr(f, 'ess') and isinstance(f.ess, DrawEssentials):
-                new_pw = max(1, f.ess.pen_width + delta)
-                f.ess.pen_width = new_pw
-                self.settings.pen_width = new_pw
-                changed = True
-            if hasattr(f, 'radius'):
+        selected = self.get_selected()
+        new_pw = new_r = None
+        for f in selected:
+            # размер считается один раз на фигуру: группа меняется как одно целое
+            leaves = [leaf for leaf in f.leaves() if isinstance(getattr(leaf, 'ess', None), DrawEssentials)]
+            if leaves:
+                new_pw = max(1, leaves[0].ess.pen_width + delta)
+                for leaf in leaves:
+                    leaf.ess.pen_width = new_pw
+            rounded = [leaf for leaf in f.leaves() if hasattr(leaf, 'radius')]
+            if rounded:
                 try:
-                    new_r = max(1, f.radius + delta)
-                    f.radius = new_r
-                    self.settings.radius = new_r
-                    changed = True
+                    new_r = max(1, rounded[0].radius + delta)
+                    for leaf in rounded:
+                        leaf.radius = new_r
                 except Exception:
-                    pass
-
+                    new_r = None
+        if new_pw is None and new_r is None:
+            return
+        # панель настроек показывает новый размер, но наши обработчики её сигналов
+        # не должны ещё раз проходить по всем выделенным фигурам
+        self.settings.penWidthChanged.disconnect(self._on_pen_width_changed)
+        self.settings.radiusChanged.disconnect(self._on_radius_changed)
+        try:
+            if new_pw is not None:
+                self.settings.pen_width = new_pw
+            if new_r is not None:
+                self.settings.radius = new_r
+        finally:
+            self.settings.penWidthChanged.connect(self._on_pen_width_changed)
+            self.settings.radiusChanged.connect(self._on_radius_changed)
+        self._restyled(selected)
+        self.canvas_updated.emit()
 
 
     def add(self, figure):
@@ -165,19 +250,37 @@ class FigureStorage(QObject):
         if incomplete and type(incomplete) == type(figure):
             incomplete.continue_drawing_point(figure.points[0][0], figure.points[0][1])
             print("Figure continued:", incomplete)
+            self.figures_changed.emit(OP_MOVE, [incomplete])
             self.canvas_updated.emit()
             return
         elif incomplete:
             QMessageBox.information(None, "info", "Откат незавершённой фигуры.")
             self.delete(incomplete)
         else:
+            self._register(figure)
             self.__figures.append(figure)
             print("Figure added:", figure)
+            self.figures_changed.emit(OP_ADD, [figure])
             self.canvas_updated.emit()
 
+    def _register(self, figure):
+        # id фигуры нужен, чтобы ссылаться на неё в дельтах; дети групп тоже получают id
+        for f in figure.walk():
+            if f.fid is None:
+                f.fid = self.__next_id
+            self.__next_id = max(self.__next_id, f.fid + 1)
+            self.__by_id[f.fid] = f
+
+    def _unregister(self, figure):
+        for f in figure.walk():
+            self.__by_id.pop(f.fid, None)
+
     def get_all(self):
         return self.__figures
 
+    def find(self, fid: int):
+        return self.__by_id.get(fid)
+
     def get_incomplete(self):
         for fig in self.__figures:
             if getattr(fig, "finished", True) is False:
@@ -200,30 +303,281 @@ class FigureStorage(QObject):
     def delete(self, figure):
         if figure in self.__figures:
             self.__figures.remove(figure)
+            self._unregister(figure)
             print("Figure deleted:", figure)
+            self.figures_changed.emit(OP_DELETE, [figure])
             self.canvas_updated.emit()
 
     def delete_selected(self):
-        before = len(self.__figures)
-        self.__figures = [f for f in self.__figures if not getattr(f, "selected", False)]
-        after = len(self.__figures)
-        if after != before:
-            print(f"Deleted {before - after} selected figure(s)")
+        removed = [f for f in self.__figures if getattr(f, "selected", False)]
+        if removed:
+            self.__figures = [f for f in self.__figures if not getattr(f, "selected", False)]
+            for f in removed:
+                self._unregister(f)
+            print(f"Deleted {len(removed)} selected figure(s)")
+            self.figures_changed.emit(OP_DELETE, removed)
             self.canvas_updated.emit()
 
     def clear_all(self):
         self.__figures.clear()
+        self.__by_id.clear()
         print("Storage cleared")
+        self.figures_changed.emit(OP_CLEAR, [])
+        self.canvas_updated.emit()
+
+    def move_selected(self, dx: int, dy: int, bounds: QRect) -> bool:
+        selected = self.get_selected()
+        for fig in selected:
+            fig.change_position(dx, dy, bounds)
+        if selected:
+            self.figures_changed.emit(OP_MOVE, selected)
+        return bool(selected)
+
+    # --- группы ---
+    def group_selected(self):
+        """Объединить выделенные фигуры в группу поверх остальных."""
+        members = [f for f in self.get_selected() if getattr(f, "finished", True)]
+        if len(members) < 2:
+            return None
+        ids = {id(f) for f in members}
+        self.__figures = [f for f in self.__figures if id(f) not in ids]
+        self.figures_changed.emit(OP_DELETE, members)
+        group = Group(members)
+        group.selected = True
+        self._register(group)
+        self.__figures.append(group)
+        print(f"Grouped {len(members)} figure(s):", group)
+        self.figures_changed.emit(OP_ADD, [group])
+        self.canvas_updated.emit()
+        return group
+
+    def ungroup_selected(self):
+        """Разобрать выделенные группы; дети остаются выделенными и встают поверх остальных,
+        как при группировке: дельта OP_ADD у ведомых и при воспроизведении журнала тоже
+        добавляет их в конец, и порядок наложения везде совпадает."""
+        groups = [f for f in self.get_selected() if isinstance(f, Group)]
+        if not groups:
+            return []
+        ids = {id(g) for g in groups}
+        self.__figures = [f for f in self.__figures if id(f) not in ids]
+        members = []
+        for g in groups:
+            self.__figures.extend(g.members)
+            self.__by_id.pop(g.fid, None)
+            for c in g.members:
+                c.group = None
+            members.extend(g.members)
+        print(f"Ungrouped {len(groups)} group(s)")
+        self.figures_changed.emit(OP_DELETE, groups)
+        self.figures_changed.emit(OP_ADD, members)
+        self.canvas_updated.emit()
+        return members
+
+    # --- дельты: фигура <-> запись scene_codec ---
+    def to_records(self, op: int, figures: list) -> list:
+        if op == OP_CLEAR:
+            return [(OP_CLEAR, 0)]
+        if op == OP_RESTYLE:
+            # у группы нет своего стиля - отправляем стиль каждого ребёнка
+            figures = self._leaves(figures)
+        return [self.to_record(op, f) for f in figures]
+
+    def to_record(self, op: int, fig):
+        if op == OP_ADD and isinstance(fig, Group):
+            return (OP_GROUP, fig.fid, [self.to_record(OP_ADD, c) for c in fig.members])
+        if op == OP_ADD:
+            pen, brush = fig.base_colors()
+            finished, radius = _finished_radius(fig)
+            return (OP_ADD, fig.fid, FIGURE_KINDS[type(fig)], finished,
+                    pen.rgba(), brush.rgba(), fig.ess.pen_width, radius, fig.points)
+        if op == OP_MOVE:
+            return (OP_MOVE, fig.fid, _finished_radius(fig)[0], fig.points)
+        if op == OP_RESTYLE:
+            pen, brush = fig.base_colors()
+            return (OP_RESTYLE, fig.fid, pen.rgba(), brush.rgba(), fig.ess.pen_width,
+                    _finished_radius(fig)[1])
+        if op == OP_DELETE:
+            return (OP_DELETE, fig.fid)
+        return (OP_CLEAR, 0)
+
+    def snapshot(self) -> list:
+        return [(OP_CLEAR, 0)] + [self.to_record(OP_ADD, f) for f in self.__figures]
+
+    def _color(self, rgba: int) -> QColor:
+        color = self.__colors.get(rgba)
+        if color is None:
+            color = self.__colors[rgba] = QColor.fromRgba(rgba)
+        return color
+
+    def _figure_from_record(self, rec, dx: int = 0, dy: int = 0, new_ids: bool = False):
+        if rec[0] == OP_GROUP:
+            group = Group([self._figure_from_record(c, dx, dy, new_ids) for c in rec[2]])
+            group.fid = None if new_ids else rec[1]
+            return group
+        _, fid, kind, finished, pen, brush, width, radius, points = rec
+        if dx or dy:
+            points = [[None if x is None else x + dx, None if y is None else y + dy] for x, y in points]
+        ess = DrawEssentials(self._color(pen), self._color(brush), width)
+        fig = FIGURE_TYPES[kind](points[0][0], points[0][1], ess=ess)
+        fig.set_points(points)
+        if _has(fig, "finished"):
+            fig.finished = finished
+        if _has(fig, "radius"):
+            fig.radius = radius
+        fig.fid = None if new_ids else fid  # копия получает новый id при регистрации
+        return fig
+
+    # --- копирование/вставка ---
+    def _selected_records(self) -> list:
+        # незавершённые фигуры не копируются: недорисованной может быть только одна
+        return [self.to_record(OP_ADD, f) for f in self.get_selected()
+                if not _has(f, "finished") or f.finished]
+
+    def copy_selected(self) -> bytes:
+        return scene_codec.encode_records(self._selected_records())
+
+    def cut_selected(self) -> bytes:
+        data = self.copy_selected()
+        self.delete_selected()
+        return data
+
+    def paste(self, data: bytes, dx: int | None = None, dy: int | None = None) -> list:
+        """Вставить фигуры из copy_selected(). Повторная вставка тех же данных сдвигается дальше."""
+        if dx is None or dy is None:
+            last, n = self.__last_paste
+            n = n + 1 if data == last else 1
+            self.__last_paste = (data, n)
+            dx = dy = self.PASTE_OFFSET * n
+        with _gc_paused():
+            return self._paste_records(scene_codec.decode_records(data), dx, dy)
+
+    def duplicate_selected(self, dx: int = PASTE_OFFSET, dy: int = PASTE_OFFSET) -> list:
+        with _gc_paused():
+            return self._paste_records(self._selected_records(), dx, dy)
+
+    def _paste_records(self, records, dx: int, dy: int) -> list:
+        records = [rec for rec in records if rec[0] in (OP_ADD, OP_GROUP)]
+        if not records:
+            return []
+        # снимаем выделение без отдельной перерисовки - она будет одна на всю вставку
+        for f in self.get_selected():
+            f.selected = False
+        pasted = []
+        for rec in records:
+            fig = self._figure_from_record(rec, dx, dy, new_ids=True)
+            self._register(fig)
+            fig.selected = True
+            pasted.append(fig)
+        self._fit_to_canvas(pasted)
+        # одна вставка в список, один сигнал и одна перерисовка на всю пачку
+        self.__figures.extend(pasted)
+        print(f"Pasted {len(pasted)} figure(s)")
+        self.figures_changed.emit(OP_ADD, pasted)
+        self.canvas_updated.emit()
+        return pasted
+
+    def _fit_to_canvas(self, figures):
+        """Сдвинуть вставленные фигуры внутрь холста: вылезшую за край фигуру
+        change_position потом уже не смог бы сдвинуть."""
+        csize = self.settings.csize
+        if csize.width() <= 0 or csize.height() <= 0:
+            return  # размер холста неизвестен (нет окна)
+        canvas = QRect(0, 0, csize.width(), csize.height())
+        union = QRect()
+        for f in figures:
+            b = f.bounds()
+            if not b.isNull():
+                union = b if union.isNull() else union.united(b)
+        if union.isNull() or Figure.is_fit_in_bounds(union, canvas):
+            return
+        sx = max(min(0, canvas.right() - union.right()), canvas.left() - union.left())
+        sy = max(min(0, canvas.bottom() - union.bottom()), canvas.top() - union.top())
+        for f in figures:
+            f.translate(sx, sy)
+        # каскад повторных вставок упёрся в край - следующая начнёт заново
+        self.__last_paste = (self.__last_paste[0], 0)
+
+    def copy_to_clipboard(self):
+        data = self.copy_selected()
+        if data:
+            mime = QMimeData()
+            mime.setData(self.CLIPBOARD_MIME, data)
+            QApplication.clipboard().setMimeData(mime)
+
+    def cut_to_clipboard(self):
+        self.copy_to_clipboard()
+        self.delete_selected()
+
+    def paste_from_clipboard(self) -> list:
+        mime = QApplication.clipboard().mimeData()
+        if mime is None or not mime.hasFormat(self.CLIPBOARD_MIME):
+            return []
+        return self.paste(bytes(mime.data(self.CLIPBOARD_MIME)))
+
+    def apply_records(self, records):
+        """Применить дельты инкрементально: без перезагрузки сцены и с одной перерисовкой."""
+        run_op, run = None, []
+        stale = False  # в списке остались удалённые или заменённые фигуры
+
+        def emit_run():
+            if run_op is not None and (run or run_op == OP_CLEAR):
+                self.figures_changed.emit(run_op, list(run))
+
+        for rec in records:
+            op = rec[0]
+            if op == OP_GROUP:
+                op = OP_ADD  # для подписчиков группа - обычная новая фигура
+            if op != run_op:
+                emit_run()
+                run_op, run = op, []
+            if op == OP_CLEAR:
+                self.__figures.clear()
+                self.__by_id.clear()
+                continue
+            fig = self.__by_id.get(rec[1])
+            if op == OP_ADD:
+                if fig is not None:
+                    self._unregister(fig)
+                    stale = True
+                fig = self._figure_from_record(rec)
+                self._register(fig)
+                self.__figures.append(fig)
+            elif fig is None:
+                continue
+            elif op == OP_MOVE:
+                fig.set_points(rec[3])
+                if _has(fig, "finished"):
+                    fig.finished = rec[2]
+                fig.invalidate_bounds()
+            elif op == OP_RESTYLE:
+                fig.set_style(self._color(rec[2]), self._color(rec[3]), rec[4])
+                if _has(fig, "radius"):
+                    fig.radius = rec[5]
+                fig.invalidate_bounds()
+            elif op == OP_DELETE:
+                self._unregister(fig)
+                stale = True
+            # подписчики (индекс сцены) знают только фигуры верхнего уровня
+            run.append(fig.root())
+        emit_run()
+        if stale:
+            # удалённые убираются из списка одним проходом, а не remove() на каждую
+            self.__figures = [f for f in self.__figures if self.__by_id.get(f.fid) is f]
         self.canvas_updated.emit()
 
 class Figure(QObject):
     tolerance = 5
     def __init__(self, ess: DrawEssentials | None = None):
         super().__init__()
-        self._ess = copy.deepcopy(ess) if isinstance(ess, DrawEssentials) else DrawEssentials()
+        # копия поверхностная: QColor здесь никогда не меняют на месте, только заменяют,
+        # поэтому фигуры могут делить одни и те же цвета (deepcopy QColor дорог)
+        self._ess = (DrawEssentials(ess.pen_color, ess.brush_color, ess.pen_width, ess.radius)
+                     if isinstance(ess, DrawEssentials) else DrawEssentials())
         self._selected = False
         self._old_pen_color = None
         self._old_brush_color = None
+        self.fid = None  # назначается FigureStorage
+        self.group = None  # группа, в которую входит фигура
 
     @property
     def ess(self) -> DrawEssentials:
@@ -239,6 +593,53 @@ class Figure(QObject):
     def bounds(self) -> QRect:
         raise NotImplementedError
 
+    def set_points(self, points):
+        for i, (x, y) in enumerate(points):
+            self.points[i][0] = x
+            self.points[i][1] = y
+
+    def translate(self, dx: int, dy: int):
+        """Сдвиг без проверки границ холста - её делает вызывающий (см. Group.change_position)."""
+        self.set_points([[None if x is None else x + dx, None if y is None else y + dy]
+                         for x, y in self.points])
+
+    def walk(self):
+        yield self
+
+    def leaves(self):
+        return [self]
+
+    def root(self):
+        fig = self
+        while fig.group is not None:
+            fig = fig.group
+        return fig
+
+    def invalidate_bounds(self):
+        # у простых фигур границы не кэшируются, но группу-владельца надо известить
+        if self.group is not None:
+            self.group.invalidate_bounds()
+
+    def base_colors(self):
+        """Цвета (pen, brush) без подсветки выделения."""
+        pen, brush = self._ess.pen_color, self._ess.brush_color
+        if self._selected:
+            if pen is SELECTION_PEN_COLOR and self._old_pen_color is not None:
+                pen = self._old_pen_color
+            if brush is SELECTION_BRUSH_COLOR and self._old_brush_color is not None:
+                brush = self._old_brush_color
+        return pen, brush
+
+    def set_style(self, pen: QColor, brush: QColor, width: int):
+        self._ess.pen_width = width
+        if self._selected:
+            # подсветка остаётся, новые цвета вернутся после снятия выделения
+            self._old_pen_color = pen
+            self._old_brush_color = brush
+        else:
+            self._ess.pen_color = pen
+            self._ess.brush_color = brush
+
     @property
     def selected(self) -> bool:
         return self._selected
@@ -246,25 +647,18 @@ class Figure(QObject):
     def selected(self, value: bool):
         if value and not self._selected:
             self._selected = True
-            try:
-                self._old_pen_color = QColor(self._ess.pen_color)
-            except Exception:
-                self._old_pen_color = self._ess.pen_color
-            try:
-                self._old_brush_color = QColor(self._ess.brush_color)
-            except Exception:
-                self._old_brush_color = self._ess.brush_color
-            self._ess.pen_color = QColor(255, 0, 0)
-            self._ess.brush_color = QColor(255, 0, 0, 100)
+            # цвета не копируем: их только заменяют, поэтому ссылки достаточно
+            self._old_pen_color = self._ess.pen_color
+            self._old_brush_color = self._ess.brush_color
+            self._ess.pen_color = SELECTION_PEN_COLOR
+            self._ess.brush_color = SELECTION_BRUSH_COLOR
         elif not value and self._selected:
             self._selected = False
-            sel_pen = QColor(255, 0, 0)
-            sel_brush = QColor(255, 0, 0, 100)
             try:
-                if self._ess.pen_color == sel_pen and self._old_pen_color is not None:
+                if self._ess.pen_color is SELECTION_PEN_COLOR and self._old_pen_color is not None:
                     self._ess.pen_color = self._old_pen_color
                 # if user changed pen color while selected, keep the new color
-                if self._ess.brush_color == sel_brush and self._old_brush_color is not None:
+                if self._ess.brush_color is SELECTION_BRUSH_COLOR and self._old_brush_color is not None:
                     self._ess.brush_color = self._old_brush_color
             except Exception:
                 # fallback: restore saved values if possible
@@ -304,6 +698,12 @@ class Point(Figure):
     @property
     def y(self): return self.__y
 
+    @property
+    def points(self): return [[self.__x, self.__y]]
+
+    def set_points(self, points):
+        self.__x, self.__y = points[0]
+
     def draw(self, painter: QPainter):
         pen = QPen(self._ess.pen_color, self.pen_width)
         brush = QBrush()
@@ -599,10 +999,131 @@ class Triangle(Figure):
                     self.points[i][0] = x
                     self.points[i][1] = y
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+UI_PATH = os.path.join(BASE_DIR, "main.ui")
+UI_CACHE_PATH = os.path.join(BASE_DIR, "__pycache__", "main_ui.py")
+JOURNAL_PATH = os.path.join(BASE_DIR, "paint.journal")
+
+def load_ui_class(ui_path: str = UI_PATH, cache_path: str = UI_CACHE_PATH):
+    """Класс формы, скомпилированный из main.ui.
+    Результат кэшируется и пересобирается (через медленный uic) только при изменении main.ui.
+    """
+    with open(ui_path, "rb") as f:
+        stamp = f"# main.ui sha1: {hashlib.sha1(f.read()).hexdigest()}\n"
+    try:
+        with open(cache_path, encoding="utf-8") as f:
+            fresh = f.readline() == stamp
+    except OSError:
+        fresh = False
+    if not fresh:
+        import io
+        from PyQt6 import uic
+        out = io.StringIO()
+        uic.compileUi(ui_path, out)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp = cache_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(stamp + out.getvalue())
+        os.replace(tmp, cache_path)
+        print("UI compiled to", cache_path)
+    spec = importlib.util.spec_from_file_location("main_ui", cache_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return next(getattr(module, n) for n in dir(module) if n.startswith("Ui_"))
+
+class Group(Figure):
+    """Составная фигура. Границы детей кэшируются, поэтому попадание, перенос и
+    отрисовка сначала проверяют группу целиком и спускаются к детям только при необходимости.
+    """
+    def __init__(self, members: list, ess: DrawEssentials | None = None):
+        super().__init__(ess)
+        self.members = list(members)
+        for c in self.members:
+            c.group = self
+        self._bounds = None
+
+    def walk(self):
+        yield self
+        for c in self.members:
+            yield from c.walk()
+
+    def leaves(self):
+        return [leaf for c in self.members for leaf in c.leaves()]
+
+    def invalidate_bounds(self):
+        self._bounds = None
+        super().invalidate_bounds()
+
+    def bounds(self) -> QRect:
+        if self._bounds is None:
+            rect = QRect()
+            for c in self.members:
+                b = c.bounds()
+                if not b.isNull():
+                    rect = b if rect.isNull() else rect.united(b)
+            self._bounds = rect
+        return self._bounds
+
+    @property
+    def points(self):
+        # точки всех детей подряд - так перенос группы передаётся одной дельтой
+        return [p for c in self.members for p in c.points]
+
+    def set_points(self, points):
+        i = 0
+        for c in self.members:
+            n = len(c.points)
+            c.set_points(points[i:i + n])
+            i += n
+        self._bounds = None
+
+    def translate(self, dx: int, dy: int):
+        for c in self.members:
+            c.translate(dx, dy)
+        if self._bounds is not None:
+            self._bounds = self._bounds.translated(dx, dy)
+
+    def change_position(self, delta_x: int, delta_y, bounds: QRect = None):
+        # одна проверка общих границ вместо проверки каждого ребёнка
+        moved = self.bounds().translated(delta_x, delta_y)
+        if bounds is None or self.is_fit_in_bounds(moved, bounds):
+            self.translate(delta_x, delta_y)
+
+    def hit_test(self, x: int, y: int) -> bool:
+        if not super().hit_test(x, y):
+            return False
+        return any(c.hit_test(x, y) for c in self.members)
+
+    def draw(self, painter: QPainter):
+        if painter.hasClipping() and not painter.clipBoundingRect().intersects(QRectF(self.bounds())):
+            return
+        for c in self.members:
+            c.draw(painter)
+
+    def base_colors(self):
+        return self.members[0].base_colors() if self.members else super().base_colors()
+
+    def set_style(self, pen: QColor, brush: QColor, width: int):
+        for c in self.leaves():
+            c.set_style(pen, brush, width)
+        self._bounds = None
+
+    def _set_selected(self, value: bool):
+        Figure.selected.fset(self, value)
+        for c in self.members:
+            c.selected = value
+
+    selected = property(Figure.selected.fget, _set_selected)
+
+# порядок задаёт код типа в дельтах scene_codec - только дописывать в конец
+FIGURE_TYPES = (Point, Line, Rectangle, Square, Circle, Ellipse, Triangle)
+FIGURE_KINDS = {t: i for i, t in enumerate(FIGURE_TYPES)}
+
 class Main(QMainWindow):
-    def __init__(self):
+    def __init__(self, sync_host: str | None = None, sync_follow: str | None = None,
+                 compiled_ui: bool = True, journal_path: str | None = JOURNAL_PATH):
         super().__init__()
-        uic.loadUi("main.ui", self)
+        self._setup_ui(compiled_ui)
         self.setWindowTitle("Paint")
         self._last_window_size = self.size()
         self._last_canvas_size = QSize(0, 0)
@@ -637,7 +1158,9 @@ class Main(QMainWindow):
                 btn.clicked.connect(lambda checked, n=name: setattr(self.settings, "tool", n))
 
         # Холст
+        self.readonly = sync_follow is not None
         self.storage = FigureStorage(self.settings)
+        self.query = None  # индекс для курсора строится после первой отрисовки
         self.canvas = getattr(self, "canvas", None)
         if self.canvas:
             self.canvas.installEventFilter(self)
@@ -645,9 +1168,85 @@ class Main(QMainWindow):
             self.canvas.setFocusPolicy(Qt.FocusPolicy.StrongFocus)  # чтобы ловить клавиши
             self.storage.canvas_updated.connect(lambda: self.canvas.update())
 
+        # Автосохранение: сцена восстанавливается из журнала до первого кадра, а не после:
+        # первый кадр сразу показывает сохранённую сцену, и ни одна правка не успевает
+        # получить id, который воспроизведение затем перезапишет. Ведомое окно журнал не ведёт.
+        self.journal = None
+        if journal_path and not self.readonly:
+            from scene_journal import SceneJournal, JournalLockedError, JournalFormatError
+            self.journal = SceneJournal(self.storage, journal_path)
+            try:
+                self.journal.start()
+            except JournalLockedError as e:
+                # журнал ведёт другое окно - работаем без автосохранения, а не портим его файл
+                self.journal = None
+                print(e)
+                QMessageBox.information(self, "Журнал",
+                                        "Журнал уже открыт другим окном, автосохранение отключено.")
+            except JournalFormatError as e:
+                # файл другой версии не воспроизводим и не затираем снимком
+                self.journal = None
+                print(e)
+                QMessageBox.warning(self, "Журнал",
+                                    f"Журнал {journal_path} записан в другом формате, "
+                                    "автосохранение отключено.")
+
+        # Синхронизация с другими окнами: ведущий рассылает дельты, ведомый только показывает.
+        # Она и индекс сцены запускаются после первой отрисовки, чтобы не задерживать появление окна.
+        self.sync = None
+        self._deferred = [self._start_query]
+        if sync_host or sync_follow:
+            self._deferred.append(lambda: self._start_sync(sync_host, sync_follow))
+        self._first_paint_done = False
+
         self._last_mouse_pos = None
         self.show()
 
+    def _setup_ui(self, compiled_ui: bool):
+        if compiled_ui:
+            try:
+                ui = load_ui_class()()
+                ui.setupUi(self)
+                # как uic.loadUi: виджеты формы доступны как атрибуты окна
+                for name, widget in vars(ui).items():
+                    setattr(self, name, widget)
+                return
+            except Exception as e:
+                print("Compiled UI unavailable, falling back to uic.loadUi:", e)
+        from PyQt6 import uic
+        uic.loadUi(UI_PATH, self)
+
+    def _start_query(self):
+        self.query = SceneQuery(self.storage)
+
+    def _start_sync(self, sync_host: str | None, sync_follow: str | None):
+        import scene_sync
+        if sync_host:
+            try:
+                self.sync = scene_sync.SceneSyncServer(self.storage, sync_host, self)
+            except RuntimeError as e:
+                # имя занято живым ведущим - работаем без синхронизации, а не падаем
+                print(e)
+                QMessageBox.warning(self, "Синхронизация",
+                                    f"Имя {sync_host} уже занято другим окном, синхронизация отключена.")
+        else:
+            self.sync = scene_sync.SceneSyncClient(self.storage, sync_follow, self)
+            self.setWindowTitle(f"Paint (follower: {sync_follow})")
+
+    def closeEvent(self, event):
+        if self.journal:
+            self.journal.close()  # дописать буфер на диск
+        super().closeEvent(event)
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self._first_paint_done:
+            self._first_paint_done = True
+            # тяжёлая инициализация - после того, как кадр уже показан
+            for job in self._deferred:
+                QTimer.singleShot(0, job)
+            self._deferred.clear()
+
     def showEvent(self, event):
         super().showEvent(event)
         if self.canvas:
@@ -676,9 +1275,28 @@ class Main(QMainWindow):
             self._last_window_size = self.size()
 
     def eventFilter(self, obj, event):
+        if self.readonly and event.type() in (QEvent.Type.KeyPress, QEvent.Type.MouseButtonPress,
+                                              QEvent.Type.MouseMove, QEvent.Type.MouseButtonRelease):
+            return True  # ведомое окно не редактирует сцену
+
         # --- клавиатура для удаления/снятия выделения ---
         if event.type() == QEvent.Type.KeyPress:
             key = event.key()
+            # буфер обмена и дублирование выделенных фигур
+            if event.modifiers() & Qt.KeyboardModifier.ControlModifier:
+                if key == Qt.Key.Key_G:
+                    if event.modifiers() & Qt.KeyboardModifier.ShiftModifier:
+                        self.storage.ungroup_selected()
+                    else:
+                        self.storage.group_selected()
+                    return True
+                actions = {Qt.Key.Key_C: self.storage.copy_to_clipboard,
+                           Qt.Key.Key_X: self.storage.cut_to_clipboard,
+                           Qt.Key.Key_V: self.storage.paste_from_clipboard,
+                           Qt.Key.Key_D: self.storage.duplicate_selected}
+                if key in actions:
+                    actions[key]()
+                    return True
             if key in (Qt.Key.Key_Delete, Qt.Key.Key_Backspace):
                 self.storage.delete_selected()
                 return True
@@ -704,20 +1322,16 @@ class Main(QMainWindow):
                     dy = pos.y() - self._last_mouse_pos.y()
                     self._last_mouse_pos = pos
 
-                    moved = False
-                    for fig in self.storage.get_all():
-                        if fig.selected:
-                            canvas_size = self.settings.csize
-                            bounds = QRect(0, 0, canvas_size.width(), canvas_size.height())
-                            fig.change_position(dx, dy, bounds)
-                            moved = True
+                    canvas_size = self.settings.csize
+                    bounds = QRect(0, 0, canvas_size.width(), canvas_size.height())
+                    moved = self.storage.move_selected(dx, dy, bounds)
                     if moved:
                         self.canvas.update()
                         print("Figure(s) moved by", dx, dy)
                         return True
                 else:
                     self._last_mouse_pos = None
-                    if any(fig.hit_test(pos.x(), pos.y()) for fig in self.storage.get_all()):
+                    if self.query is not None and self.query.hit(pos.x(), pos.y()) is not None:
                         self.canvas.setCursor(Qt.CursorShape.PointingHandCursor)
                     else:
                         self.canvas.setCursor(Qt.CursorShape.ArrowCursor)
@@ -773,6 +1387,7 @@ class Main(QMainWindow):
             if event.type() == QEvent.Type.Paint:
                 painter = QPainter(self.canvas)
                 painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+                painter.setClipRect(event.rect())  # группы вне области перерисовки пропускаются
                 figures_count = 0
                 for fig in self.storage.get_all():
                     fig.draw(painter)
@@ -783,7 +1398,18 @@ class Main(QMainWindow):
 
         return super().eventFilter(obj, event)
 
+def _arg_value(argv, flag):
+    if flag in argv and argv.index(flag) + 1 < len(argv):
+        return argv[argv.index(flag) + 1]
+    return None
+
 if __name__ == "__main__":
+    # python main.py [--sync-host NAME | --sync-follow NAME] [--journal PATH | --no-journal]
+    #                [--runtime-ui]
     app = QApplication(sys.argv)
-    window = Main()
+    window = Main(sync_host=_arg_value(sys.argv, "--sync-host"),
+                  sync_follow=_arg_value(sys.argv, "--sync-follow"),
+                  compiled_ui="--runtime-ui" not in sys.argv,
+                  journal_path=None if "--no-journal" in sys.argv
+                  else _arg_value(sys.argv, "--journal") or JOURNAL_PATH)
     sys.exit(app.exec())
@@ -0,0 +1,193 @@
+"""Компактное бинарное представление изменений сцены (дельт).
+
+Запись - кортеж, первый элемент которого код операции:
+    (OP_ADD, fid, kind, finished, pen, brush, width, radius, points)
+    (OP_DELETE, fid)
+    (OP_MOVE, fid, finished, points)
+    (OP_RESTYLE, fid, pen, brush, width, radius)
+    (OP_CLEAR, 0)
+    (OP_GROUP, fid, children)     children - записи OP_ADD/OP_GROUP дочерних фигур
+pen/brush - цвета в формате QColor.rgba(), radius - радиус точки (0 у фигур
+без радиуса), points - список [x, y] (None для ещё не заданных точек). Модуль не зависит от Qt.
+"""
+import struct
+
+OP_ADD, OP_DELETE, OP_MOVE, OP_RESTYLE, OP_CLEAR, OP_GROUP = range(6)
+
+NONE_COORD = -0x80000000
+
+_HEAD = struct.Struct("<BI")        # op, fid
+_ADD = struct.Struct("<BBIIHHB")    # kind, finished, pen, brush, width, radius, n points
+_MOVE = struct.Struct("<BI")        # finished, n points (у группы - точки всех фигур)
+_STYLE = struct.Struct("<IIHH")     # pen, brush, width, radius
+_POINT = struct.Struct("<ii")
+_COUNT = struct.Struct("<I")        # число дочерних записей группы
+_FRAME = struct.Struct("<I")        # длина кадра
+
+
+def _pack_points(out: bytearray, points):
+    for x, y in points:
+        out += _POINT.pack(NONE_COORD if x is None else x, NONE_COORD if y is None else y)
+
+
+def _unpack_points(data, pos: int, n: int):
+    points = []
+    for _ in range(n):
+        x, y = _POINT.unpack_from(data, pos)
+        pos += _POINT.size
+        points.append([None if x == NONE_COORD else x, None if y == NONE_COORD else y])
+    return points, pos
+
+
+def encode_records(records) -> bytes:
+    out = bytearray()
+    _encode_into(out, records)
+    return bytes(out)
+
+
+def _encode_into(out: bytearray, records):
+    for rec in records:
+        op = rec[0]
+        out += _HEAD.pack(op, rec[1])
+        if op == OP_ADD:
+            _, _, kind, finished, pen, brush, width, radius, points = rec
+            out += _ADD.pack(kind, finished, pen, brush, width, radius, len(points))
+            _pack_points(out, points)
+        elif op == OP_MOVE:
+            _, _, finished, points = rec
+            out += _MOVE.pack(finished, len(points))
+            _pack_points(out, points)
+        elif op == OP_RESTYLE:
+            out += _STYLE.pack(rec[2], rec[3], rec[4], rec[5])
+        elif op == OP_GROUP:
+            out += _COUNT.pack(len(rec[2]))
+            _encode_into(out, rec[2])
+        elif op not in (OP_DELETE, OP_CLEAR):
+            raise ValueError(f"Unknown delta op: {op}")
+
+
+def _decode_one(data, pos: int):
+    op, fid = _HEAD.unpack_from(data, pos)
+    pos += _HEAD.size
+    if op == OP_ADD:
+        kind, finished, pen, brush, width, radius, n = _ADD.unpack_from(data, pos)
+        pos += _ADD.size
+        points, pos = _unpack_points(data, pos, n)
+        return (op, fid, kind, bool(finished), pen, brush, width, radius, points), pos
+    if op == OP_MOVE:
+        finished, n = _MOVE.unpack_from(data, pos)
+        pos += _MOVE.size
+        points, pos = _unpack_points(data, pos, n)
+        return (op, fid, bool(finished), points), pos
+    if op == OP_RESTYLE:
+        pen, brush, width, radius = _STYLE.unpack_from(data, pos)
+        return (op, fid, pen, brush, width, radius), pos + _STYLE.size
+    if op == OP_GROUP:
+        (n,) = _COUNT.unpack_from(data, pos)
+        pos += _COUNT.size
+        children = []
+        for _ in range(n):
+            child, pos = _decode_one(data, pos)
+            children.append(child)
+        return (op, fid, children), pos
+    if op in (OP_DELETE, OP_CLEAR):
+        return (op, fid), pos
+    raise ValueError(f"Unknown delta op: {op}")
+
+
+def decode_records(data) -> list:
+    records = []
+    pos, end = 0, len(data)
+    while pos < end:
+        rec, pos = _decode_one(data, pos)
+        records.append(rec)
+    return records
+
+
+def _record_end(data, pos: int) -> int:
+    op, _ = _HEAD.unpack_from(data, pos)
+    pos += _HEAD.size
+    if op == OP_ADD:
+        n = data[pos + _ADD.size - 1]
+        return pos + _ADD.size + n * _POINT.size
+    if op == OP_MOVE:
+        _, n = _MOVE.unpack_from(data, pos)
+        return pos + _MOVE.size + n * _POINT.size
+    if op == OP_RESTYLE:
+        return pos + _STYLE.size
+    if op == OP_GROUP:
+        (n,) = _COUNT.unpack_from(data, pos)
+        pos += _COUNT.size
+        for _ in range(n):
+            pos = _record_end(data, pos)
+        return pos
+    if op in (OP_DELETE, OP_CLEAR):
+        return pos
+    raise ValueError(f"Unknown delta op: {op}")
+
+
+def split_records(data) -> list:
+    """Записи верхнего уровня как (op, fid, байты записи) - без разбора точек."""
+    records = []
+    pos, end = 0, len(data)
+    while pos < end:
+        op, fid = _HEAD.unpack_from(data, pos)
+        nxt = _record_end(data, pos)
+        records.append((op, fid, bytes(data[pos:nxt])))
+        pos = nxt
+    return records
+
+
+def nested_fids(group: bytes) -> list:
+    """fid всех фигур внутри закодированной записи OP_GROUP."""
+    fids = []
+
+    def walk(pos):
+        (n,) = _COUNT.unpack_from(group, pos + _HEAD.size)
+        pos += _HEAD.size + _COUNT.size
+        for _ in range(n):
+            op, fid = _HEAD.unpack_from(group, pos)
+            fids.append(fid)
+            if op == OP_GROUP:
+                walk(pos)
+            pos = _record_end(group, pos)
+
+    walk(0)
+    return fids
+
+
+def with_move(add: bytes, move: bytes):
+    """Закодированная OP_ADD с точками и finished из OP_MOVE той же фигуры;
+    None, если число точек не совпадает."""
+    base = _HEAD.size
+    finished, n = _MOVE.unpack_from(move, base)
+    if n != add[base + _ADD.size - 1]:
+        return None
+    return add[:base + 1] + bytes((finished,)) + add[base + 2:base + _ADD.size] + move[base + _MOVE.size:]
+
+
+def with_style(add: bytes, style: bytes) -> bytes:
+    """Закодированная OP_ADD со стилем из OP_RESTYLE той же фигуры."""
+    base = _HEAD.size
+    # pen, brush, width, radius лежат в OP_ADD сразу после kind и finished
+    return add[:base + 2] + style[base:base + _STYLE.size] + add[base + 2 + _STYLE.size:]
+
+
+def pack_frame(records) -> bytes:
+    payload = encode_records(records)
+    return _FRAME.pack(len(payload)) + payload
+
+
+def split_frames(buf: bytearray) -> list:
+    """Вынуть из буфера все полные кадры; неполный хвост остаётся в buf."""
+    frames = []
+    pos = 0
+    while len(buf) - pos >= _FRAME.size:
+        (size,) = _FRAME.unpack_from(buf, pos)
+        if len(buf) - pos - _FRAME.size < size:
+            break
+        start = pos + _FRAME.size
+        frames.append(bytes(buf[start:start + size]))
+        pos = start + size
+    del buf[:pos]
+    return frames
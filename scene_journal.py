@@ -0,0 +1,253 @@
+"""Журнал изменений сцены для восстановления после сбоя.
+
+Каждое изменение FigureStorage (сигнал figures_changed) кодируется в дельты
+scene_codec и дописывается в конец файла. Запись на диск делает фоновый поток,
+поэтому обработчики мыши и отрисовка не ждут диска. Когда журнал разрастается,
+он заменяется снимком сцены (checkpoint) через временный файл и os.replace.
+Снимок собирает тот же поток из уже записанных дельт (_SceneState), так что
+сжатие не обращается к живым фигурам и не занимает поток интерфейса.
+
+Формат файла: последовательность кадров <длина:u32><crc32:u32><дельты>.
+Первый кадр - заголовок MAGIC + версия формата; журнал другой версии не
+воспроизводится (JournalFormatError) и не перезаписывается.
+При воспроизведении оборванный или испорченный хвост отбрасывается.
+Пока журнал открыт, рядом держится QLockFile <журнал>.lock: второй процесс
+с тем же журналом получит JournalLockedError, а не затрёт чужую сцену.
+"""
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+from PyQt6.QtCore import QLockFile
+
+import scene_codec
+from scene_codec import OP_ADD, OP_DELETE, OP_MOVE, OP_RESTYLE, OP_CLEAR, OP_GROUP
+
+_FRAME = struct.Struct("<II")
+_VERSION = struct.Struct("<H")
+MAGIC = b"PAINTJRN"
+VERSION = 3  # 2: OP_MOVE хранит число точек в u32 (группы); 3: радиус точки в OP_ADD/OP_RESTYLE
+_CHECKPOINT = object()
+_SEED = object()
+_STOP = object()
+
+
+def pack_frame(payload: bytes) -> bytes:
+    return _FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def header_frame() -> bytes:
+    return pack_frame(MAGIC + _VERSION.pack(VERSION))
+
+
+def _read_header(data: bytes) -> int:
+    """Проверить заголовок журнала, вернуть позицию первого кадра с дельтами."""
+    size = len(MAGIC) + _VERSION.size
+    if len(data) >= _FRAME.size:
+        length, crc = _FRAME.unpack_from(data, 0)
+        payload = data[_FRAME.size:_FRAME.size + size]
+        if length == size and payload[:len(MAGIC)] == MAGIC and zlib.crc32(payload) == crc:
+            (version,) = _VERSION.unpack_from(payload, len(MAGIC))
+            if version != VERSION:
+                raise JournalFormatError(f"Journal format version {version}, expected {VERSION}")
+            return _FRAME.size + size
+    raise JournalFormatError("Not a journal file or written by an older version")
+
+
+def read_records(path: str) -> list:
+    """Все записи журнала до первого повреждённого кадра."""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return []
+    if not data:
+        return []
+    records, pos = [], _read_header(data)
+    while len(data) - pos >= _FRAME.size:
+        size, crc = _FRAME.unpack_from(data, pos)
+        start = pos + _FRAME.size
+        payload = data[start:start + size]
+        try:
+            if len(payload) < size or zlib.crc32(payload) != crc:
+                raise ValueError("bad frame")
+            records.extend(scene_codec.decode_records(payload))
+        except (ValueError, struct.error):
+            print(f"Journal tail damaged at byte {pos}, dropped {len(data) - pos} byte(s)")
+            break
+        pos = start + size
+    return records
+
+
+class JournalLockedError(RuntimeError):
+    pass
+
+
+class JournalFormatError(RuntimeError):
+    pass
+
+
+class _SceneState:
+    """Снимок сцены, свёрнутый из уже закодированных дельт так же, как их применяет
+    FigureStorage.apply_records. Точки не разбираются: на каждую фигуру хранится её
+    OP_ADD/OP_GROUP и последние OP_MOVE/OP_RESTYLE, а при сжатии сдвиг и стиль
+    простой фигуры вклеиваются в байты её OP_ADD.
+    """
+    def __init__(self):
+        self._top = {}     # fid фигуры верхнего уровня -> OP_ADD/OP_GROUP, в порядке наложения
+        self._nested = {}  # fid группы -> fid всех фигур внутри неё
+        self._changes = {}  # (op, fid) -> последняя OP_MOVE/OP_RESTYLE фигуры
+
+    def apply(self, payload: bytes):
+        top, changes = self._top, self._changes
+        for op, fid, raw in scene_codec.split_records(payload):
+            if op == OP_MOVE or op == OP_RESTYLE:
+                changes[(op, fid)] = raw
+            elif op == OP_CLEAR:
+                top.clear()
+                self._nested.clear()
+                changes.clear()
+            elif op == OP_DELETE:
+                self._drop(fid)
+            else:
+                self._drop(fid)  # повторное добавление заменяет фигуру и поднимает её наверх
+                top[fid] = raw
+                if op == OP_GROUP:
+                    self._nested[fid] = scene_codec.nested_fids(raw)
+
+    def snapshot(self) -> bytes:
+        top, changes = self._top, self._changes
+        for fid, add in top.items():
+            if add[0] != OP_ADD:
+                continue  # у группы точки и стиль детей остаются отдельными записями
+            style = changes.pop((OP_RESTYLE, fid), None)
+            if style is not None:
+                add = scene_codec.with_style(add, style)
+            move = changes.get((OP_MOVE, fid))
+            if move is not None:
+                moved = scene_codec.with_move(add, move)
+                if moved is not None:
+                    add = moved
+                    del changes[(OP_MOVE, fid)]
+            top[fid] = add
+        return (scene_codec.encode_records([(OP_CLEAR, 0)])
+                + b"".join(top.values()) + b"".join(changes.values()))
+
+    def _drop(self, fid):
+        self._top.pop(fid, None)
+        for f in [fid] + self._nested.pop(fid, []):
+            self._changes.pop((OP_MOVE, f), None)
+            self._changes.pop((OP_RESTYLE, f), None)
+
+
+class SceneJournal:
+    CHECKPOINT_RECORDS = 100000   # не реже, чем раз в столько записей...
+    CHECKPOINT_SCENE_FACTOR = 4   # ...и не чаще, чем журнал в 4 раза длиннее сцены
+    FLUSH_INTERVAL = 0.5          # сек, как часто буфер уходит на диск
+    BUFFER_LIMIT = 1 << 20
+
+    def __init__(self, storage, path: str):
+        self.storage = storage
+        self.path = path
+        self._since_checkpoint = 0
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._state = _SceneState()  # принадлежит потоку записи
+        self._lock = QLockFile(path + ".lock")
+        self._lock.setStaleLockTime(0)  # устаревшей считается только блокировка умершего процесса
+
+    def start(self) -> int:
+        """Восстановить сцену из журнала, сжать его и начать запись. Возвращает число записей."""
+        if not self._lock.tryLock(0):
+            raise JournalLockedError(f"Journal {self.path} is in use by another process")
+        try:
+            records = read_records(self.path)
+        except JournalFormatError:
+            self._lock.unlock()  # чужой файл не трогаем
+            raise
+        preloaded = bool(self.storage.get_all())
+        if records:
+            self.storage.apply_records(records)
+            print(f"Journal replayed: {len(records)} record(s), {len(self.storage.get_all())} figure(s)")
+        if preloaded:
+            # сцена была не пуста до журнала - исходное состояние для потока записи берём из неё;
+            # кодирование отвязывает записи от живых фигур
+            records = scene_codec.decode_records(scene_codec.encode_records(self.storage.snapshot()))
+        self._queue.put((_SEED, records))
+        self._thread = threading.Thread(target=self._writer, name="scene-journal", daemon=True)
+        self._thread.start()
+        self.checkpoint()
+        self.storage.figures_changed.connect(self._on_figures_changed)
+        return len(records)
+
+    def _on_figures_changed(self, op: int, figures: list):
+        # кодируем сразу: фоновый поток не должен читать живые фигуры
+        records = self.storage.to_records(op, figures)
+        self._queue.put(scene_codec.encode_records(records))
+        self._since_checkpoint += len(records)
+        limit = max(self.CHECKPOINT_RECORDS,
+                    self.CHECKPOINT_SCENE_FACTOR * len(self.storage.get_all()))
+        if self._since_checkpoint >= limit:
+            self.checkpoint()
+
+    def checkpoint(self):
+        # снимок соберёт поток записи из своих дельт - здесь только отметка в очереди
+        self._since_checkpoint = 0
+        self._queue.put(_CHECKPOINT)
+
+    def close(self):
+        if self._thread is not None:
+            self.storage.figures_changed.disconnect(self._on_figures_changed)
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+            self._lock.unlock()
+
+    # --- фоновый поток ---
+    def _writer(self):
+        f = open(self.path, "ab")
+        buf = bytearray()
+        last_flush = time.monotonic()
+
+        def flush():
+            nonlocal last_flush
+            last_flush = time.monotonic()
+            if buf:
+                f.write(buf)
+                buf.clear()
+                f.flush()
+                os.fsync(f.fileno())
+
+        while True:
+            try:
+                item = self._queue.get(timeout=self.FLUSH_INTERVAL)
+            except queue.Empty:
+                flush()
+                continue
+            if item is _STOP:
+                flush()
+                f.close()
+                return
+            if isinstance(item, tuple) and item[0] is _SEED:
+                self._state.apply(scene_codec.encode_records(item[1]))
+                continue
+            if item is _CHECKPOINT:
+                # снимок заменяет всё записанное ранее, включая недописанный буфер
+                buf.clear()
+                f.close()
+                tmp = self.path + ".tmp"
+                with open(tmp, "wb") as t:
+                    t.write(header_frame())
+                    t.write(pack_frame(self._state.snapshot()))
+                    t.flush()
+                    os.fsync(t.fileno())
+                os.replace(tmp, self.path)
+                f = open(self.path, "ab")
+                continue
+            self._state.apply(item)
+            buf += pack_frame(item)
+            if len(buf) >= self.BUFFER_LIMIT or time.monotonic() - last_flush >= self.FLUSH_INTERVAL:
+                flush()
@@ -0,0 +1,262 @@
+"""Пространственные запросы к сцене без отрисовки.
+
+SceneQuery держит сеточный индекс по bounds() фигур FigureStorage и обновляет
+его по сигналу figures_changed: добавленные, сдвинутые и перекрашенные фигуры
+только помечаются и переиндексируются при следующем запросе, поэтому
+перетаскивание большого выделения не платит за индекс на каждом шаге. Подсчёты по области и карта плотности
+считаются векторно через numpy, если он установлен. numpy импортируется при
+первом таком запросе, а не вместе с модулем: импорт main не должен его ждать.
+"""
+import heapq
+
+from scene_codec import OP_ADD, OP_DELETE, OP_MOVE, OP_RESTYLE, OP_CLEAR
+
+_np = None
+_np_loaded = False
+
+
+def _numpy():
+    global _np, _np_loaded
+    if not _np_loaded:
+        _np_loaded = True
+        try:
+            import numpy
+            _np = numpy
+        except ImportError:  # numpy не обязателен: тогда агрегация в чистом Python
+            pass
+    return _np
+
+
+class SceneQuery:
+    CELL = 64
+
+    def __init__(self, storage, cell: int = CELL):
+        self.storage = storage
+        self.cell = cell
+        self._figs = {}    # fid -> фигура
+        self._boxes = {}   # fid -> (left, top, right, bottom), границы включительно
+        self._grid = {}    # (cx, cy) -> set(fid)
+        self._extent = None  # [min cx, min cy, max cx, max cy] занятых ячеек; при удалении не сжимается
+        self._z = None     # id(фигуры) -> позиция в storage.get_all(), строится по требованию
+        self._arrays = None
+        self._dirty = {}   # fid -> фигура, ждущая переиндексации
+        storage.figures_changed.connect(self._on_figures_changed)
+        self.rebuild()
+
+    # --- поддержка индекса ---
+    def rebuild(self):
+        self._figs.clear()
+        self._boxes.clear()
+        self._grid.clear()
+        self._extent = None
+        self._dirty.clear()
+        for fig in self.storage.get_all():
+            self._insert(fig)
+        self._z = None
+        self._arrays = None
+
+    def _flush(self):
+        if self._dirty:
+            for fid, fig in self._dirty.items():
+                self._remove(fid)
+                self._insert(fig)
+            self._dirty.clear()
+            self._arrays = None
+
+    def _cells(self, box):
+        c = self.cell
+        for cx in range(box[0] // c, box[2] // c + 1):
+            for cy in range(box[1] // c, box[3] // c + 1):
+                yield cx, cy
+
+    def _insert(self, fig):
+        b = fig.bounds()
+        if b.isNull():
+            return  # незавершённая фигура без точек - попасть в неё нельзя
+        box = (b.left(), b.top(), b.right(), b.bottom())
+        self._figs[fig.fid] = fig
+        self._boxes[fig.fid] = box
+        for key in self._cells(box):
+            self._grid.setdefault(key, set()).add(fig.fid)
+        c = self.cell
+        lo_x, lo_y, hi_x, hi_y = box[0] // c, box[1] // c, box[2] // c, box[3] // c
+        if self._extent is None:
+            self._extent = [lo_x, lo_y, hi_x, hi_y]
+        else:
+            e = self._extent
+            e[0], e[1], e[2], e[3] = min(e[0], lo_x), min(e[1], lo_y), max(e[2], hi_x), max(e[3], hi_y)
+
+    def _remove(self, fid):
+        box = self._boxes.pop(fid, None)
+        self._figs.pop(fid, None)
+        if box is None:
+            return
+        for key in self._cells(box):
+            bucket = self._grid.get(key)
+            if bucket is not None:
+                bucket.discard(fid)
+                if not bucket:
+                    del self._grid[key]
+
+    def _on_figures_changed(self, op: int, figures: list):
+        if op == OP_CLEAR:
+            self.rebuild()
+            return
+        if op == OP_DELETE:
+            for fig in figures:
+                self._dirty.pop(fig.fid, None)
+                self._remove(fig.fid)
+            self._arrays = None
+        else:
+            for fig in figures:
+                self._dirty[fig.fid] = fig
+        if op in (OP_ADD, OP_DELETE):
+            self._z = None  # порядок наложения меняют только добавление и удаление
+
+    def _as_arrays(self):
+        # (fids, boxes[n, 4], kinds[n], kind_names) - пересобираются только после изменений
+        self._flush()
+        if self._arrays is None:
+            fids = list(self._boxes)
+            kinds, names = [], {}
+            for fid in fids:
+                name = type(self._figs[fid]).__name__
+                kinds.append(names.setdefault(name, len(names)))
+            boxes = [self._boxes[fid] for fid in fids]
+            np = _numpy()
+            if np is not None:
+                boxes = np.array(boxes, dtype=np.int64).reshape(-1, 4)
+                kinds = np.array(kinds, dtype=np.int64)
+            self._arrays = (fids, boxes, kinds, list(names))
+        return self._arrays
+
+    # --- запросы ---
+    def _z_order(self, figures) -> list:
+        # сверху та фигура, что позже в списке хранилища (так же рисуется и выбирается кликом)
+        if len(figures) < 2:
+            return figures
+        if self._z is None:
+            self._z = {id(f): i for i, f in enumerate(self.storage.get_all())}
+        return sorted(figures, key=lambda f: self._z.get(id(f), -1), reverse=True)
+
+    def figures_at(self, x: int, y: int) -> list:
+        """Фигуры под точкой, сверху вниз."""
+        self._flush()
+        bucket = self._grid.get((x // self.cell, y // self.cell), ())
+        return self._z_order([self._figs[fid] for fid in bucket if self._figs[fid].hit_test(x, y)])
+
+    def hit(self, x: int, y: int):
+        """Верхняя фигура под точкой или None."""
+        hits = self.figures_at(x, y)
+        return hits[0] if hits else None
+
+    def in_region(self, left: int, top: int, right: int, bottom: int) -> list:
+        """Фигуры, чьи границы пересекают прямоугольник (границы включительно)."""
+        self._flush()
+        if self._extent is None:
+            return []
+        # обходим только занятую часть сетки, а если ячеек в области больше, чем занятых, - сами занятые
+        c, e = self.cell, self._extent
+        lo_x, lo_y = max(left // c, e[0]), max(top // c, e[1])
+        hi_x, hi_y = min(right // c, e[2]), min(bottom // c, e[3])
+        if lo_x > hi_x or lo_y > hi_y:
+            return []
+        found = set()
+        if (hi_x - lo_x + 1) * (hi_y - lo_y + 1) > len(self._grid):
+            for (cx, cy), bucket in self._grid.items():
+                if lo_x <= cx <= hi_x and lo_y <= cy <= hi_y:
+                    found.update(bucket)
+        else:
+            for cx in range(lo_x, hi_x + 1):
+                for cy in range(lo_y, hi_y + 1):
+                    found.update(self._grid.get((cx, cy), ()))
+        result = []
+        for fid in sorted(found):
+            l, t, r, b = self._boxes[fid]
+            if l <= right and r >= left and t <= bottom and b >= top:
+                result.append(self._figs[fid])
+        return result
+
+    def count_by_type(self, left: int, top: int, right: int, bottom: int) -> dict:
+        """Число фигур каждого типа, пересекающих прямоугольник."""
+        fids, boxes, kinds, names = self._as_arrays()
+        if not fids:
+            return {}
+        np = _numpy()
+        if np is not None:
+            mask = ((boxes[:, 0] <= right) & (boxes[:, 2] >= left) &
+                    (boxes[:, 1] <= bottom) & (boxes[:, 3] >= top))
+            counts = np.bincount(kinds[mask], minlength=len(names))
+            return {names[i]: int(n) for i, n in enumerate(counts) if n}
+        result = {}
+        for (l, t, r, b), k in zip(boxes, kinds):
+            if l <= right and r >= left and t <= bottom and b >= top:
+                result[names[k]] = result.get(names[k], 0) + 1
+        return result
+
+    @staticmethod
+    def _distance2(box, x, y):
+        dx = max(box[0] - x, 0, x - box[2])
+        dy = max(box[1] - y, 0, y - box[3])
+        return dx * dx + dy * dy
+
+    def _cell_distance2(self, cx, cy, x, y):
+        c = self.cell
+        return self._distance2((cx * c, cy * c, cx * c + c - 1, cy * c + c - 1), x, y)
+
+    def nearest(self, x: int, y: int, k: int = 1) -> list:
+        """k ближайших к точке фигур (расстояние до границ), ближние первыми.
+        Ячейки сетки обходятся от ближних к дальним (куча по расстоянию до ячейки),
+        пока следующая ячейка не дальше k-й найденной фигуры.
+        """
+        self._flush()
+        if not self._boxes or k <= 0:
+            return []
+        e = self._extent
+        start = (min(max(x // self.cell, e[0]), e[2]), min(max(y // self.cell, e[1]), e[3]))
+        cells = [(self._cell_distance2(*start, x, y), start)]
+        queued = {start}
+        best, seen = [], set()  # best - max-куча (-d2, -fid) из k лучших
+        boxes, grid = self._boxes, self._grid
+        while cells:
+            d2, (cx, cy) = heapq.heappop(cells)
+            if len(best) == k and d2 > -best[0][0]:
+                break
+            for fid in grid.get((cx, cy), frozenset()).difference(seen):
+                seen.add(fid)
+                l, t, r, b = boxes[fid]
+                dx = max(l - x, 0, x - r)
+                dy = max(t - y, 0, y - b)
+                item = (-(dx * dx + dy * dy), -fid)
+                if len(best) < k:
+                    heapq.heappush(best, item)
+                elif item > best[0]:
+                    heapq.heapreplace(best, item)
+            for key in ((cx - 1, cy), (cx + 1, cy), (cx, cy - 1), (cx, cy + 1)):
+                if key not in queued and e[0] <= key[0] <= e[2] and e[1] <= key[1] <= e[3]:
+                    queued.add(key)
+                    heapq.heappush(cells, (self._cell_distance2(*key, x, y), key))
+        return [self._figs[-fid] for _, fid in sorted(best, reverse=True)]
+
+    def density(self, width: int, height: int, cell: int | None = None):
+        """Карта плотности: число центров фигур в каждой ячейке cell x cell холста width x height.
+        Возвращает numpy-массив [строки, столбцы], без numpy - список строк.
+        """
+        cell = cell or self.cell
+        cols, rows = max(1, -(-width // cell)), max(1, -(-height // cell))
+        fids, boxes, _, _ = self._as_arrays()
+        np = _numpy()
+        if np is not None:
+            heat = np.zeros((rows, cols), dtype=np.int64)
+            if fids:
+                cx = (boxes[:, 0] + boxes[:, 2]) // 2 // cell
+                cy = (boxes[:, 1] + boxes[:, 3]) // 2 // cell
+                inside = (cx >= 0) & (cx < cols) & (cy >= 0) & (cy < rows)
+                np.add.at(heat, (cy[inside], cx[inside]), 1)
+            return heat
+        heat = [[0] * cols for _ in range(rows)]
+        for l, t, r, b in boxes:
+            cx, cy = (l + r) // 2 // cell, (t + b) // 2 // cell
+            if 0 <= cx < cols and 0 <= cy < rows:
+                heat[cy][cx] += 1
+        return heat
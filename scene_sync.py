@@ -0,0 +1,140 @@
+"""Синхронизация сцены между процессами через локальный сокет.
+
+Ведущий процесс (SceneSyncServer) владеет FigureStorage и рассылает ведомым
+(SceneSyncClient) кадры с бинарными дельтами из scene_codec. Изменения копятся
+и отправляются пачкой раз в FLUSH_INTERVAL_MS. Если ведомый не успевает
+читать (в сокете больше HIGH_WATERMARK байт), отправка ему приостанавливается,
+а очередь схлопывается: move/restyle одной фигуры заменяют предыдущие.
+"""
+from PyQt6.QtCore import QObject, QTimer
+from PyQt6.QtNetwork import QAbstractSocket, QLocalServer, QLocalSocket
+
+import scene_codec
+from scene_codec import OP_ADD, OP_DELETE, OP_MOVE, OP_RESTYLE, OP_CLEAR, OP_GROUP
+
+
+def _enqueue(pending: dict, records):
+    # ключ (op, fid): повторный move/restyle заменяет запись на её прежнем месте
+    for rec in records:
+        op, fid = rec[0], rec[1]
+        if op == OP_CLEAR:
+            pending.clear()
+            pending[(OP_CLEAR, 0)] = rec
+        elif op == OP_DELETE:
+            pending.pop((OP_MOVE, fid), None)
+            pending.pop((OP_RESTYLE, fid), None)
+            if pending.pop((OP_ADD, fid), None) is None:
+                pending[(OP_DELETE, fid)] = rec
+        elif op == OP_GROUP:
+            pending[(OP_ADD, fid)] = rec  # группа добавляется как обычная фигура
+        else:
+            pending[(op, fid)] = rec
+
+
+class SceneSyncServer(QObject):
+    FLUSH_INTERVAL_MS = 16
+    HIGH_WATERMARK = 1 << 20
+
+    def __init__(self, storage, name: str, parent=None):
+        super().__init__(parent)
+        self.storage = storage
+        self._clients = {}  # QLocalSocket -> очередь записей
+        self._server = QLocalServer(self)
+        listening = self._server.listen(name)
+        if (not listening and self._server.serverError() == QAbstractSocket.SocketError.AddressInUseError
+                and not self._is_alive(name)):
+            # остатки после аварийного завершения: живой ведущий на этом имени не отвечает
+            QLocalServer.removeServer(name)
+            listening = self._server.listen(name)
+        if not listening:
+            raise RuntimeError(f"Cannot listen on {name}: {self._server.errorString()}")
+        self._server.newConnection.connect(self._on_new_connection)
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(self.FLUSH_INTERVAL_MS)
+        self._timer.timeout.connect(self._flush)
+        storage.figures_changed.connect(self._on_figures_changed)
+        print("Sync server listening on", name)
+
+    @staticmethod
+    def _is_alive(name: str) -> bool:
+        probe = QLocalSocket()
+        probe.connectToServer(name)
+        alive = probe.waitForConnected(200)
+        probe.abort()
+        return alive
+
+    def _on_new_connection(self):
+        while self._server.hasPendingConnections():
+            sock = self._server.nextPendingConnection()
+            pending = {}
+            _enqueue(pending, self.storage.snapshot())
+            self._clients[sock] = pending
+            sock.bytesWritten.connect(lambda _n, s=sock: self._flush_client(s))
+            sock.disconnected.connect(lambda s=sock: self._on_disconnected(s))
+            print("Sync follower connected, clients:", len(self._clients))
+            self._flush_client(sock)
+
+    def _on_disconnected(self, sock):
+        if self._clients.pop(sock, None) is not None:
+            print("Sync follower disconnected, clients:", len(self._clients))
+        sock.deleteLater()
+
+    def _on_figures_changed(self, op: int, figures: list):
+        if not self._clients:
+            return
+        records = self.storage.to_records(op, figures)
+        for pending in self._clients.values():
+            _enqueue(pending, records)
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def _flush(self):
+        for sock in list(self._clients):
+            self._flush_client(sock)
+
+    def _flush_client(self, sock):
+        pending = self._clients.get(sock)
+        if not pending or sock.bytesToWrite() > self.HIGH_WATERMARK:
+            return  # допишем по сигналу bytesWritten
+        sock.write(scene_codec.pack_frame(pending.values()))
+        pending.clear()
+
+    def close(self):
+        for sock in list(self._clients):
+            sock.disconnectFromServer()
+        self._clients.clear()
+        self._server.close()
+
+
+class SceneSyncClient(QObject):
+    RECONNECT_MS = 1000
+
+    def __init__(self, storage, name: str, parent=None):
+        super().__init__(parent)
+        self.storage = storage
+        self.name = name
+        self._buf = bytearray()
+        self._sock = QLocalSocket(self)
+        self._sock.readyRead.connect(self._on_ready_read)
+        self._sock.connected.connect(lambda: print("Sync connected to", self.name))
+        self._sock.disconnected.connect(self._schedule_reconnect)
+        self._sock.errorOccurred.connect(self._schedule_reconnect)
+        self._sock.connectToServer(name)
+
+    def _schedule_reconnect(self, *_):
+        self._buf.clear()
+        QTimer.singleShot(self.RECONNECT_MS, self._reconnect)
+
+    def _reconnect(self):
+        if self._sock.state() == QLocalSocket.LocalSocketState.UnconnectedState:
+            self._sock.connectToServer(self.name)
+
+    def _on_ready_read(self):
+        self._buf += bytes(self._sock.readAll())
+        records = []
+        for frame in scene_codec.split_frames(self._buf):
+            records.extend(scene_codec.decode_records(frame))
+        if records:
+            # все дошедшие кадры применяются разом - одна перерисовка
+            self.storage.apply_records(records)